@@ -9,6 +9,21 @@ app = Celery('backend')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+# Route tasks to queues by workload so each can get a matching worker pool
+# (a worker without -Q only consumes the default 'celery' queue; see README):
+#   hashing (CPU-bound):
+#     celery -A backend worker -Q hashing -P prefork -c <physical cores> --prefetch-multiplier=1
+#   summaries (OpenAI calls, I/O-bound):
+#     celery -A backend worker -Q summaries -P gevent -c 100 --prefetch-multiplier=1
+#   maintenance (short SQL jobs):
+#     celery -A backend worker -Q maintenance -P prefork -c 2
+app.conf.task_routes = {
+    'chat.tasks.hash_and_dedupe_uploaded_file': {'queue': 'hashing'},
+    'chat.tasks.generate_*': {'queue': 'summaries'},
+    'chat.tasks.cleanup_*': {'queue': 'maintenance'},
+    'chat.tasks.requeue_pending_uploads': {'queue': 'maintenance'},
+}
+
 # Celery Beat Schedule
 app.conf.beat_schedule = {
     'cleanup-old-conversations': {
@@ -20,6 +35,10 @@ app.conf.beat_schedule = {
         'task': 'chat.tasks.generate_missing_summaries',
         'schedule': crontab(hour=3, minute=0),  # Daily at 3 AM
     },
+    'requeue-pending-uploads': {
+        'task': 'chat.tasks.requeue_pending_uploads',
+        'schedule': crontab(minute='*/15'),  # Uploads whose dedupe task never ran
+    },
 }
 
 @app.task(bind=True)
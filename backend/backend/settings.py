@@ -97,6 +97,20 @@ DATABASES = {
     }
 }
 
+# Cache
+# Summary debounce locks, message counters and context hashes are shared between
+# the web and Celery worker processes, so the cache must live in Redis
+
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.getenv("REDIS_CACHE_URL", "redis://localhost:6379/1"),
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        },
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -164,4 +178,7 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_TRACK_STARTED = True
-CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
\ No newline at end of file
+CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
+# RedBeat keeps the schedule in Redis with an O(log n) tick and survives beat restarts
+CELERY_BEAT_SCHEDULER = 'redbeat.RedBeatScheduler'
+CELERY_REDBEAT_REDIS_URL = os.getenv('CELERY_REDBEAT_REDIS_URL', CELERY_BROKER_URL)
@@ -3,10 +3,13 @@ from django.utils.timezone import now
 from django.db.models import Count
 from datetime import timedelta
 from chat.models import Conversation
+from chat.tasks import cleanup_old_conversations, delete_conversations_in_batches
 import logging
 
 logger = logging.getLogger(__name__)
 
+PREVIEW_SIZE = 5
+
 class Command(BaseCommand):
     help = 'Clean up old conversations based on age'
     
@@ -27,11 +30,18 @@ class Command(BaseCommand):
             type=str,
             help='Only delete conversations for specific user'
         )
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='run_async',
+            help='Queue the deletion as a Celery task instead of running it here'
+        )
     
     def handle(self, *args, **options):
         days = options['days']
         dry_run = options['dry_run']
         user_filter = options.get('user')
+        run_async = options['run_async']
         
         cutoff_date = now() - timedelta(days=days)
         queryset = Conversation.objects.filter(created_at__lt=cutoff_date)
@@ -39,7 +49,12 @@ class Command(BaseCommand):
         if user_filter:
             queryset = queryset.filter(user__username=user_filter)
         
-        count = queryset.count()
+        if dry_run:
+            # one annotated query for the preview; a short preview is also the full count
+            preview = list(queryset.annotate(message_count=Count('versions__messages'))[:PREVIEW_SIZE])
+            count = len(preview) if len(preview) < PREVIEW_SIZE else queryset.count()
+        else:
+            count = queryset.count()
         
         if count == 0:
             self.stdout.write(
@@ -51,16 +66,21 @@ class Command(BaseCommand):
         
         if dry_run:
             self.stdout.write(self.style.WARNING('DRY RUN - No deletions made\n'))
-            for conv in queryset[:5]:
+            for conv in preview:
                 self.stdout.write(
-                    f"  - {conv.title} ({conv.messages.count()} messages)"
+                    f"  - {conv.title} ({conv.message_count} messages)"
                 )
             return
         
         confirm = input(f"Delete {count} conversations? (yes/no): ")
         
         if confirm.lower() == 'yes':
-            deleted_count = queryset.delete()[0]
+            if run_async:
+                cleanup_old_conversations.delay(days, user_filter, raw=True)
+                self.stdout.write(self.style.SUCCESS('✓ Deletion queued'))
+                return
+            # no signal handlers listen for these deletes, so skip the collector
+            deleted_count = delete_conversations_in_batches(queryset, raw=True)
             self.stdout.write(
                 self.style.SUCCESS(f'✓ Deleted {deleted_count} conversations')
             )
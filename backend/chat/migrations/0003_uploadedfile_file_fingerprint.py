@@ -0,0 +1,22 @@
+# Generated by Django 5.2.11 on 2026-10-15 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_activitylog_filepermission_uploadedfile_userrole_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='file_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedfile',
+            index=models.Index(fields=['file_size', 'file_fingerprint'], name='chat_upload_file_si_93c235_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-15 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_uploadedfile_file_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadedfile',
+            name='file_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
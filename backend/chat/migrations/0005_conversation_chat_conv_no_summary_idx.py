@@ -0,0 +1,21 @@
+# Generated by Django 5.2.11 on 2026-10-15 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_alter_uploadedfile_file_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(
+                condition=models.Q(('summary__isnull', True)),
+                fields=['-created_at'],
+                name='chat_conv_no_summary_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.11 on 2026-10-15 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_conversation_chat_conv_no_summary_idx'),
+    ]
+
+    operations = [
+        # existing rows were hashed with SHA256
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='hash_algo',
+            field=models.CharField(default='sha256', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='uploadedfile',
+            name='hash_algo',
+            field=models.CharField(default='blake3', max_length=16),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.11 on 2026-10-15 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_uploadedfile_hash_algo'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='conversation',
+            name='chat_conver_is_summ_c1de9d_idx',
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(
+                condition=models.Q(('is_summary_stale', True)),
+                fields=['-created_at'],
+                name='chat_conv_stale_summary_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-15 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_conversation_stale_summary_partial_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversation',
+            name='is_summary_stale',
+            field=models.BooleanField(default=True, help_text='Indicates if summary needs to be regenerated'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 import uuid
 import hashlib
+
+import blake3
 from django.db import models
 
 from authentication.models import CustomUser
@@ -34,7 +36,7 @@ class Conversation(models.Model):
         help_text="Timestamp when summary was generated"
     )
     is_summary_stale = models.BooleanField(
-        default=False,
+        default=True,  # new conversations have no summary yet
         help_text="Indicates if summary needs to be regenerated"
     )
 
@@ -42,7 +44,17 @@ class Conversation(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['user', '-created_at']),
-            models.Index(fields=['is_summary_stale']),
+            # partial indexes only cover the small set of conversations whose summary needs work
+            models.Index(
+                fields=['-created_at'],
+                name='chat_conv_stale_summary_idx',
+                condition=models.Q(is_summary_stale=True),
+            ),
+            models.Index(
+                fields=['-created_at'],
+                name='chat_conv_no_summary_idx',
+                condition=models.Q(summary__isnull=True),
+            ),
         ]
     def __str__(self):
         return self.title
@@ -78,10 +90,6 @@ class Message(models.Model):
     class Meta:
         ordering = ["created_at"]
 
-    def save(self, *args, **kwargs):
-        self.version.conversation.save()
-        super().save(*args, **kwargs)
-
     def __str__(self):
         return f"{self.role}: {self.content[:20]}..."
 
@@ -117,7 +125,9 @@ class UploadedFile(models.Model):
     filename = models.CharField(max_length=255)
     file_size = models.BigIntegerField()  # in bytes
     file_type = models.CharField(max_length=50)  # e.g., 'pdf', 'docx'
-    file_hash = models.CharField(max_length=64, unique=True)  # SHA256
+    file_hash = models.CharField(max_length=64, unique=True, null=True, blank=True)  # hex digest, set lazily by worker
+    hash_algo = models.CharField(max_length=16, default='blake3')  # 'sha256' for rows hashed before BLAKE3
+    file_fingerprint = models.CharField(max_length=32, blank=True, default="")  # sampled MD5
 
     status = models.CharField(
         max_length=20,
@@ -139,23 +149,59 @@ class UploadedFile(models.Model):
         indexes = [
             models.Index(fields=['user', '-uploaded_at']),
             models.Index(fields=['file_hash']),
+            models.Index(fields=['file_size', 'file_fingerprint']),
             models.Index(fields=['status']),
         ]
 
     def __str__(self):
         return f"{self.filename} ({self.user.username})"
 
+    # size of each window sampled by calculate_file_fingerprint
+    FINGERPRINT_WINDOW_SIZE = 64 * 1024
+
+    # 4 MiB reads amortize the per-call Python overhead on large uploads
+    HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+    @staticmethod
+    def calculate_file_hash(file_obj, algo='blake3'):
+        """Calculate BLAKE3 hash of file, or SHA256 to match rows hashed before the switch"""
+        hasher = blake3.blake3() if algo == 'blake3' else hashlib.new(algo)
+        for chunk in file_obj.chunks(chunk_size=UploadedFile.HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+        file_obj.seek(0)  # Reset file pointer
+        return hasher.hexdigest()
+
+    @staticmethod
+    def files_equal(file_a, file_b):
+        """Compare two files byte for byte, to confirm a hash match before calling them duplicates"""
+        if file_a.size != file_b.size:
+            return False
+        chunk_size = UploadedFile.HASH_CHUNK_SIZE
+        equal = all(
+            chunk_a == chunk_b
+            for chunk_a, chunk_b in zip(file_a.chunks(chunk_size=chunk_size), file_b.chunks(chunk_size=chunk_size))
+        )
+        file_a.seek(0)  # Reset file pointers
+        file_b.seek(0)
+        return equal
+
     @staticmethod
-    def calculate_file_hash(file_obj):
-        """Calculate SHA256 hash of file"""
-        hash_sha256 = hashlib.sha256()
-        for chunk in file_obj.chunks():
-            hash_sha256.update(chunk)
+    def calculate_file_fingerprint(file_obj):
+        """Calculate a cheap MD5 fingerprint over the first, middle and last 64 KB of a file"""
+        window = UploadedFile.FINGERPRINT_WINDOW_SIZE
+        size = file_obj.size
+        fingerprint = hashlib.md5(usedforsecurity=False)
+        for offset in (0, size // 2, max(size - window, 0)):
+            file_obj.seek(offset)
+            fingerprint.update(hashlib.md5(file_obj.read(window), usedforsecurity=False).digest())
         file_obj.seek(0)  # Reset file pointer
-        return hash_sha256.hexdigest()
+        return fingerprint.hexdigest()
 
-    def save(self, *args, **kwargs):
-        if self.file and not self.file_hash:
+    def save(self, *args, defer_hash=False, **kwargs):
+        if self.file and not self.file_fingerprint:
+            self.file_fingerprint = self.calculate_file_fingerprint(self.file)
+        # defer_hash leaves hashing to the hash_and_dedupe_uploaded_file task
+        if self.file and not self.file_hash and not defer_hash:
             self.file_hash = self.calculate_file_hash(self.file)
         super().save(*args, **kwargs)
 
@@ -6,6 +6,8 @@ from chat.models import Conversation, Message, Role, Version
 
 # file upload related serializer
 from chat.models import UploadedFile
+from chat.summary_service import ConversationSummaryService
+from chat.tasks import schedule_conversation_summary, schedule_uploaded_file_dedupe
 
 
 def should_serialize(validated_data, field_name) -> bool:
@@ -23,19 +25,22 @@ class VersionTimeIdSerializer(serializers.Serializer):
 
 
 class MessageSerializer(serializers.ModelSerializer):
+    # writable so nested VersionSerializer updates can address existing messages
+    id = serializers.UUIDField(required=False)
     role = serializers.SlugRelatedField(slug_field="name", queryset=Role.objects.all())
 
     class Meta:
         model = Message
         fields = [
-            "id",  # DB
+            "id",  # DB, only used to match existing messages on update
             "content",
             "role",  # required
             "created_at",  # DB, read-only
         ]
-        read_only_fields = ["id", "created_at", "version"]
+        read_only_fields = ["created_at", "version"]
 
     def create(self, validated_data):
+        validated_data.pop("id", None)  # ids are always generated for new messages
         message = Message.objects.create(**validated_data)
         return message
 
@@ -66,7 +71,8 @@ class VersionSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_active(obj):
-        return obj == obj.conversation.active_version
+        # compare ids so the active version row itself is never fetched
+        return obj.conversation.active_version_id == obj.id
 
     @staticmethod
     def get_created_at(obj):
@@ -74,11 +80,29 @@ class VersionSerializer(serializers.ModelSerializer):
             return timezone.localtime(obj.conversation.created_at)
         return timezone.localtime(obj.root_message.created_at)
 
+    @staticmethod
+    def bulk_create_messages(version, messages_data):
+        """
+        Insert messages in one query. bulk_create skips Message.save() and post_save, so the conversation is
+        touched once here and a single summary refresh is scheduled.
+        """
+        if not messages_data:
+            return
+        # ids are only accepted to address existing messages in update(); new rows always get a server id
+        for message_data in messages_data:
+            message_data.pop("id", None)
+        Message.objects.bulk_create(
+            [Message(version=version, **message_data) for message_data in messages_data], batch_size=500
+        )
+        conversation_id = version.conversation_id
+        ConversationSummaryService.increment_message_count(conversation_id, len(messages_data))
+        Conversation.objects.filter(pk=conversation_id).update(modified_at=timezone.now())
+        schedule_conversation_summary(conversation_id)
+
     def create(self, validated_data):
         messages_data = validated_data.pop("messages")
         version = Version.objects.create(**validated_data)
-        for message_data in messages_data:
-            Message.objects.create(version=version, **message_data)
+        self.bulk_create_messages(version, messages_data)
 
         return version
 
@@ -99,14 +123,26 @@ class VersionSerializer(serializers.ModelSerializer):
         instance.save()
 
         messages_data = validated_data.pop("messages", [])
-        for message_data in messages_data:
-            if "id" in message_data:
-                message = Message.objects.get(id=message_data["id"], version=instance)
+        updated_messages_data = [message_data for message_data in messages_data if "id" in message_data]
+        new_messages_data = [message_data for message_data in messages_data if "id" not in message_data]
+
+        if updated_messages_data:
+            messages_by_id = Message.objects.filter(version=instance).in_bulk(
+                [message_data["id"] for message_data in updated_messages_data]
+            )
+            for message_data in updated_messages_data:
+                message = messages_by_id.get(message_data["id"])
+                if message is None:
+                    raise serializers.ValidationError(
+                        {"messages": f"Message {message_data['id']} not found in version {instance.id}"}
+                    )
                 message.content = message_data.get("content", message.content)
                 message.role = message_data.get("role", message.role)
-                message.save()
-            else:
-                Message.objects.create(version=instance, **message_data)
+            Message.objects.bulk_update(messages_by_id.values(), ["content", "role"], batch_size=500)
+            # bulk_update skips post_save, so touch the conversation here
+            Conversation.objects.filter(pk=instance.conversation_id).update(modified_at=timezone.now())
+
+        self.bulk_create_messages(instance, new_messages_data)
 
         return instance
 
@@ -171,7 +207,10 @@ class ConversationSummarySerializer(serializers.ModelSerializer):
         ]
 
     def get_message_count(self, obj):
-        from chat.models import Message
+        # annotated by ConversationSummaryViewSet; fall back for bare instances
+        message_count = getattr(obj, "message_count", None)
+        if message_count is not None:
+            return message_count
         return Message.objects.filter(
             version__conversation=obj
         ).count()
@@ -180,9 +219,11 @@ class ConversationSummarySerializer(serializers.ModelSerializer):
 class UploadedFileSerializer(serializers.ModelSerializer):
     """Serializer for UploadedFile model.
 
-    When a file is provided we calculate its hash and check for duplicates so
-    the same file cannot be uploaded more than once.  Some metadata is also
-    populated automatically (filename, size, type, owner).
+    Uploads are accepted immediately with ``status='pending'``; duplicate
+    detection runs in a Celery task which marks the file as ``completed`` or
+    ``failed``.  The task only hashes the full file when an earlier upload
+    shares its size and sampled fingerprint.  Some metadata is also populated
+    automatically (filename, size, type, owner).
     """
 
     class Meta:
@@ -218,16 +259,6 @@ class UploadedFileSerializer(serializers.ModelSerializer):
             "is_indexed",
         ]
 
-    def validate_file(self, value):
-        """Compute SHA256 of the incoming file and reject duplicates."""
-        # calculate and then rewind pointer so the same file object can still be
-        # saved by Django's storage backend
-        file_hash = UploadedFile.calculate_file_hash(value)
-        value.seek(0)
-        if UploadedFile.objects.filter(file_hash=file_hash).exists():
-            raise serializers.ValidationError("A file with the same content has already been uploaded.")
-        return value
-
     def create(self, validated_data):
         # automatically populate some meta fields that the client doesn't need
         request = self.context.get("request")
@@ -244,4 +275,9 @@ class UploadedFileSerializer(serializers.ModelSerializer):
             else:
                 validated_data["file_type"] = ""
 
-        return super().create(validated_data)
\ No newline at end of file
+        # hashing a large file would block the request, so leave it to a worker
+        validated_data["status"] = "pending"
+        instance = UploadedFile(**validated_data)
+        instance.save(defer_hash=True)
+        schedule_uploaded_file_dedupe(instance.id)
+        return instance
\ No newline at end of file
@@ -1,30 +1,35 @@
 from django.db.models.signals import post_save, m2m_changed
 from django.dispatch import receiver
 from django.core.cache import cache
+from django.db import transaction
+from django.utils.timezone import now
 from chat.models import Conversation, Message
 from chat.summary_service import ConversationSummaryService
+from chat.tasks import schedule_conversation_summary
 import logging
     
 logger = logging.getLogger(__name__)
 
+@receiver(post_save, sender=Message)
+def touch_conversation_on_message_save(sender, instance, **kwargs):
+    """Bump the conversation's modified_at with a single UPDATE, without firing its save signals"""
+    # filter through the version id so an uncached Version row is never loaded
+    Conversation.objects.filter(versions=instance.version_id).update(modified_at=now())
+
 @receiver(post_save, sender=Message)
 def regenerate_summary_on_message_save(sender, instance, created, **kwargs):
-    """Generate summary after new message is added"""
-    if created and instance.conversation:
-        conversation = instance.conversation
-        
-        # Only regenerate if we have enough messages
-        if conversation.messages.count() >= ConversationSummaryService.MIN_MESSAGES_FOR_SUMMARY:
-            ConversationSummaryService.update_conversation_summary(conversation)
+    """Queue summary regeneration after new message is added"""
+    if created:
+        conversation_id = instance.version.conversation_id
+        ConversationSummaryService.increment_message_count(conversation_id)
+        schedule_conversation_summary(conversation_id)
 
 @receiver(post_save, sender=Conversation)
 def handle_conversation_save(sender, instance, created, **kwargs):
     """Handle conversation creation"""
     if created:
-        logger.info(f"New conversation created: {instance.id}")
-        # Initialize summary as stale so it's generated later
-        instance.is_summary_stale = True
-        Conversation.objects.filter(id=instance.id).update(is_summary_stale=True)
+        # is_summary_stale defaults to True, so there is nothing to write here
+        transaction.on_commit(lambda: logger.info(f"New conversation created: {instance.id}"))
 
 # Connect signals in apps.py
 def ready():
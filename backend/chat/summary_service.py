@@ -1,9 +1,11 @@
+import hashlib
 import logging
 import json
 from typing import Optional
 from datetime import timedelta
 from django.utils.timezone import now
 from django.core.cache import cache
+from chat.models import Message
 from src.libs import openai
 
 logger = logging.getLogger(__name__)
@@ -14,7 +16,32 @@ class ConversationSummaryService:
     MAX_TOKENS = 200
     SUMMARY_CACHE_TIMEOUT = 3600  # 1 hour
     MIN_MESSAGES_FOR_SUMMARY = 3
+    SUMMARY_DEBOUNCE_COUNTDOWN = 30  # seconds to wait for a burst of messages to settle
+    SUMMARY_DEBOUNCE_TIMEOUT = 60
+    SUMMARY_CONTEXT_HASH_TIMEOUT = 86400  # 24 hours
+    MESSAGE_COUNT_CACHE_TIMEOUT = 3600  # bounds drift from deletes and unsignalled inserts
     
+    @staticmethod
+    def get_message_count(conversation_id) -> int:
+        """Return the conversation's message count from cache, seeding it from the database on a miss"""
+        cache_key = f"msg_count_{conversation_id}"
+        count = cache.get(cache_key)
+        if count is None:
+            count = Message.objects.filter(version__conversation_id=conversation_id).count()
+            cache.add(cache_key, count, ConversationSummaryService.MESSAGE_COUNT_CACHE_TIMEOUT)
+        return count
+
+    @staticmethod
+    def increment_message_count(conversation_id, delta=1):
+        """Bump the cached message count; a missing counter is left for the next read to seed"""
+        try:
+            cache.incr(f"msg_count_{conversation_id}", delta)
+        except ValueError:
+            pass
+        except Exception as e:
+            # runs inside message writes, so a cache outage only costs drift until MESSAGE_COUNT_CACHE_TIMEOUT
+            logger.warning(f"Could not update message count for conversation {conversation_id}: {str(e)}")
+
     @staticmethod
     def generate_summary(conversation) -> Optional[str]:
         """
@@ -27,20 +54,37 @@ class ConversationSummaryService:
             Generated summary string or None
         """
         try:
-            # Check if conversation has enough messages
-            message_count = conversation.messages.count()
+            messages = Message.objects.filter(version__conversation=conversation)
+
+            # Check if conversation has enough messages; the cached counter only gates scheduling,
+            # this authoritative count also re-seeds it
+            message_count = messages.count()
+            cache.set(
+                f"msg_count_{conversation.id}",
+                message_count,
+                ConversationSummaryService.MESSAGE_COUNT_CACHE_TIMEOUT
+            )
             if message_count < ConversationSummaryService.MIN_MESSAGES_FOR_SUMMARY:
                 logger.info(f"Conversation {conversation.id} has insufficient messages for summary")
                 return None
             
-            # Fetch all messages for context
-            messages = conversation.messages.all().order_by('created_at')
+            # Fetch (role, content) pairs for context in a single query
+            message_rows = messages.order_by('created_at').values_list('role__name', 'content')[:10]
             
             # Build context from messages
-            context = "\n".join([
-                f"{'User' if msg.role.name == 'user' else 'Assistant'}: {msg.content[:200]}"
-                for msg in messages[:10]  # Limit to last 10 messages
-            ])
+            context = "\n".join(
+                f"{'User' if role_name == 'user' else 'Assistant'}: {content[:200]}"
+                for role_name, content in message_rows
+            )
+            
+            # Skip the API call when the context hasn't changed since the last summary
+            context_hash = hashlib.blake2b(context.encode(), digest_size=16).hexdigest()
+            context_hash_key = f"sum_ctxhash_{conversation.id}"
+            if cache.get(context_hash_key) == context_hash:
+                cached_summary = ConversationSummaryService.get_cached_summary(conversation)
+                if cached_summary:
+                    logger.info(f"Context unchanged for conversation {conversation.id}, reusing summary")
+                    return cached_summary
             
             # Call OpenAI API
             response = openai.ChatCompletion.create(
@@ -60,6 +104,7 @@ class ConversationSummaryService:
             )
             
             summary = response['choices'][0]['message']['content'].strip()
+            cache.set(context_hash_key, context_hash, ConversationSummaryService.SUMMARY_CONTEXT_HASH_TIMEOUT)
             logger.info(f"Successfully generated summary for conversation {conversation.id}")
             return summary
             
@@ -124,4 +169,4 @@ class ConversationSummaryService:
         """Mark summary as needing regeneration (e.g., when conversation is edited)"""
         conversation.is_summary_stale = True
         conversation.save(update_fields=['is_summary_stale'])
-        cache.delete(f"conversation_summary_{conversation.id}")
\ No newline at end of file
+        cache.delete_many([f"conversation_summary_{conversation.id}", f"sum_ctxhash_{conversation.id}"])
\ No newline at end of file
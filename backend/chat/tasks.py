@@ -1,45 +1,254 @@
-from celery import shared_task
+from celery import group, shared_task
+from kombu.exceptions import OperationalError
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
 from django.utils.timezone import now
 from datetime import timedelta
-from chat.models import Conversation
+from chat.models import Conversation, Message, UploadedFile, Version
 from chat.summary_service import ConversationSummaryService
 import logging
 
 logger = logging.getLogger(__name__)
 
+CLEANUP_BATCH_SIZE = 1000
+
+def raw_delete_conversations(conversation_ids, using='default'):
+    """
+    Delete conversations and their versions and messages without Django's collector or signals.
+    _raw_delete doesn't cascade, so SET_NULL references are cleared by hand and rows go child-first.
+    """
+    with transaction.atomic(using=using):
+        version_ids = list(
+            Version.objects.using(using).filter(conversation_id__in=conversation_ids).values_list('pk', flat=True)
+        )
+        UploadedFile.objects.using(using).filter(conversation_id__in=conversation_ids).update(conversation=None)
+        Conversation.objects.using(using).filter(pk__in=conversation_ids).update(active_version=None)
+        Version.objects.using(using).filter(parent_version_id__in=version_ids).update(parent_version=None)
+        Version.objects.using(using).filter(root_message__version_id__in=version_ids).update(root_message=None)
+        Message.objects.filter(version_id__in=version_ids)._raw_delete(using)
+        Version.objects.filter(pk__in=version_ids)._raw_delete(using)
+        return Conversation.objects.filter(pk__in=conversation_ids)._raw_delete(using)
+
+def delete_conversations_in_batches(queryset, batch_size=CLEANUP_BATCH_SIZE, raw=False):
+    """
+    Delete the conversations matched by queryset a batch of primary keys at a time, so the
+    cascade collector never has to hold the whole set in memory. With raw=True the collector
+    and signals are skipped entirely. Returns the number deleted.
+    """
+    deleted_count = 0
+    pks = queryset.order_by().values_list('pk', flat=True)
+    while True:
+        batch = list(pks[:batch_size])
+        if not batch:
+            break
+        if raw:
+            deleted_count += raw_delete_conversations(batch, using=queryset.db)
+            continue
+        _, deleted_per_model = Conversation.objects.filter(pk__in=batch).delete()
+        deleted_count += deleted_per_model.get(Conversation._meta.label, 0)
+    return deleted_count
+
 @shared_task(name='chat.tasks.cleanup_old_conversations')
-def cleanup_old_conversations(days=30):
+def cleanup_old_conversations(days=30, username=None, raw=False):
     """Clean up conversations older than specified days"""
     cutoff_date = now() - timedelta(days=days)
-    deleted_count, _ = Conversation.objects.filter(
-        created_at__lt=cutoff_date
-    ).delete()
+    queryset = Conversation.objects.filter(created_at__lt=cutoff_date)
+    if username:
+        queryset = queryset.filter(user__username=username)
+    deleted_count = delete_conversations_in_batches(queryset, raw=raw)
     
     logger.info(f"Cleanup task: Deleted {deleted_count} conversations")
     return {'deleted': deleted_count}
 
 @shared_task(name='chat.tasks.generate_missing_summaries')
 def generate_missing_summaries():
-    """Generate summaries for conversations that don't have one"""
-    conversations = Conversation.objects.filter(
-        summary__isnull=True,
-        messages__isnull=False
-    ).distinct()[:50]  # Limit to prevent overload
+    """Queue summary generation for conversations that don't have one"""
+    # EXISTS stops at the first message instead of joining and grouping every one
+    has_messages = Exists(Message.objects.filter(version__conversation_id=OuterRef('pk')))
+    conversation_ids = list(
+        Conversation.objects.filter(has_messages, summary__isnull=True)
+        .values_list('id', flat=True)[:50]  # Limit to prevent overload
+    )
     
-    count = 0
-    for conversation in conversations:
-        if ConversationSummaryService.update_conversation_summary(conversation):
-            count += 1
+    # Each summary is an OpenAI round trip, so run them in parallel across the pool
+    group(
+        generate_conversation_summary_task.s(str(conversation_id))
+        for conversation_id in conversation_ids
+    ).apply_async()
     
-    logger.info(f"Generated summaries for {count} conversations")
-    return {'generated': count}
+    logger.info(f"Queued summary generation for {len(conversation_ids)} conversations")
+    return {'queued': len(conversation_ids)}
+
+def schedule_conversation_summary(conversation_id):
+    """Queue a delayed summary regeneration once the transaction commits, collapsing a burst into a single task"""
+    # all cache and broker work runs after commit, so an outage of either can't fail the message write
+    transaction.on_commit(lambda: _dispatch_conversation_summary(conversation_id))
+
+def _dispatch_conversation_summary(conversation_id):
+    """Send the debounced summary task, leaving the conversation stale if the cache or broker is unreachable"""
+    lock_key = f"sum_pending_{conversation_id}"
+    try:
+        message_count = ConversationSummaryService.get_message_count(conversation_id)
+        if message_count < ConversationSummaryService.MIN_MESSAGES_FOR_SUMMARY:
+            return
+        if not cache.add(lock_key, 1, ConversationSummaryService.SUMMARY_DEBOUNCE_TIMEOUT):
+            return
+    except Exception as e:
+        logger.error(f"Could not schedule summary for conversation {conversation_id}: {str(e)}")
+        Conversation.objects.filter(pk=conversation_id).update(is_summary_stale=True)
+        return
+
+    try:
+        generate_conversation_summary_task.apply_async(
+            args=[str(conversation_id)],
+            countdown=ConversationSummaryService.SUMMARY_DEBOUNCE_COUNTDOWN
+        )
+    except OperationalError as e:
+        logger.error(f"Could not queue summary for conversation {conversation_id}: {str(e)}")
+        Conversation.objects.filter(pk=conversation_id).update(is_summary_stale=True)
+        try:
+            cache.delete(lock_key)
+        except Exception:
+            # the lock expires on its own after SUMMARY_DEBOUNCE_TIMEOUT
+            pass
 
 @shared_task(name='chat.tasks.generate_conversation_summary_task')
 def generate_conversation_summary_task(conversation_id):
     """Generate summary for a specific conversation"""
+    # let messages arriving from now on schedule a fresh run
+    cache.delete(f"sum_pending_{conversation_id}")
     try:
         conversation = Conversation.objects.get(id=conversation_id)
         return ConversationSummaryService.update_conversation_summary(conversation)
     except Conversation.DoesNotExist:
         logger.error(f"Conversation {conversation_id} not found")
-        return False
\ No newline at end of file
+        return False
+
+PENDING_UPLOAD_REQUEUE_AFTER = timedelta(minutes=15)
+
+def schedule_uploaded_file_dedupe(file_id):
+    """Queue duplicate detection for an upload once the transaction that created it commits"""
+    transaction.on_commit(lambda: _dispatch_uploaded_file_dedupe(file_id))
+
+def _dispatch_uploaded_file_dedupe(file_id):
+    """Send the dedupe task; if the broker is unreachable the upload stays pending for requeue_pending_uploads"""
+    try:
+        hash_and_dedupe_uploaded_file.delay(str(file_id))
+    except OperationalError as e:
+        logger.error(f"Could not queue dedupe for uploaded file {file_id}: {str(e)}")
+
+@shared_task(name='chat.tasks.requeue_pending_uploads')
+def requeue_pending_uploads():
+    """Re-dispatch uploads left pending by a lost or never-sent dedupe task"""
+    file_ids = list(
+        UploadedFile.objects.filter(status='pending', uploaded_at__lt=now() - PENDING_UPLOAD_REQUEUE_AFTER)
+        .values_list('id', flat=True)[:500]  # Limit to prevent overload
+    )
+
+    # the task skips rows that are no longer pending, so a late original delivery is harmless
+    group(hash_and_dedupe_uploaded_file.s(str(file_id)) for file_id in file_ids).apply_async()
+
+    logger.info(f"Requeued {len(file_ids)} pending uploads")
+    return {'queued': len(file_ids)}
+
+def _store_lazy_file_hash(uploaded_file):
+    """Hash an earlier upload that never needed its digest until a newer upload collided with it"""
+    file_hash = UploadedFile.calculate_file_hash(uploaded_file.file)
+    try:
+        with transaction.atomic():
+            UploadedFile.objects.filter(pk=uploaded_file.pk, file_hash__isnull=True).update(
+                file_hash=file_hash, hash_algo='blake3'
+            )
+    except IntegrityError:
+        # the earlier upload is itself an undetected duplicate; still compare against it
+        pass
+    uploaded_file.file_hash = file_hash
+    uploaded_file.hash_algo = 'blake3'
+
+def _find_duplicate(uploaded_file, own_hashes):
+    """
+    Return an earlier upload with the same content, or None. Full hashes are only computed when an
+    earlier upload shares this one's size and sampled fingerprint; own_hashes collects them by algorithm.
+    """
+    earlier = Q(uploaded_at__lt=uploaded_file.uploaded_at) | Q(
+        uploaded_at=uploaded_file.uploaded_at, id__lt=uploaded_file.id
+    )
+    candidates = (
+        UploadedFile.objects.filter(earlier, file_size=uploaded_file.file_size)
+        # rows uploaded before fingerprints existed can't be ruled out
+        .filter(Q(file_fingerprint=uploaded_file.file_fingerprint) | Q(file_fingerprint=''))
+        .exclude(status='failed')
+    )
+    for candidate in candidates:
+        if not candidate.file_hash:
+            _store_lazy_file_hash(candidate)
+        if candidate.hash_algo not in own_hashes:
+            own_hashes[candidate.hash_algo] = UploadedFile.calculate_file_hash(
+                uploaded_file.file, algo=candidate.hash_algo
+            )
+        is_duplicate = (
+            candidate.file_hash == own_hashes[candidate.hash_algo]
+            and UploadedFile.files_equal(uploaded_file.file, candidate.file)
+        )
+        candidate.file.close()
+        if is_duplicate:
+            return candidate
+    return None
+
+def _mark_duplicate(uploaded_file):
+    """Fail a duplicate upload and drop its bytes from storage"""
+    uploaded_file.status = 'failed'
+    uploaded_file.error_message = 'duplicate'
+    # delete() leaves the name empty; saving 'file' clears the stored path so nothing points at missing bytes
+    uploaded_file.file.delete(save=False)
+    uploaded_file.save(update_fields=['status', 'error_message', 'processed_at', 'file'], defer_hash=True)
+
+@shared_task(name='chat.tasks.hash_and_dedupe_uploaded_file')
+def hash_and_dedupe_uploaded_file(file_id):
+    """Mark an uploaded file as completed, or failed if it is a byte-identical duplicate of an earlier one"""
+    try:
+        uploaded_file = UploadedFile.objects.get(id=file_id)
+    except UploadedFile.DoesNotExist:
+        logger.error(f"Uploaded file {file_id} not found")
+        return False
+
+    # a redelivered or re-queued task must not hash the same file twice
+    if uploaded_file.status != 'pending':
+        return uploaded_file.status == 'completed'
+
+    own_hashes = {}
+    try:
+        duplicate = _find_duplicate(uploaded_file, own_hashes)
+    except Exception as e:
+        # e.g. this file or a candidate's is missing from storage; a retry would fail the same way
+        logger.error(f"Dedupe failed for uploaded file {file_id}: {str(e)}")
+        UploadedFile.objects.filter(pk=uploaded_file.pk, status='pending').update(
+            status='failed', error_message=str(e), processed_at=now()
+        )
+        return False
+    finally:
+        uploaded_file.file.close()
+
+    uploaded_file.processed_at = now()
+    if duplicate is not None:
+        _mark_duplicate(uploaded_file)
+        return False
+
+    uploaded_file.status = 'completed'
+    update_fields = ['status', 'processed_at']
+    # the digest is only known when a collision required it; otherwise a later upload hashes it lazily
+    if 'blake3' in own_hashes:
+        uploaded_file.file_hash = own_hashes['blake3']
+        uploaded_file.hash_algo = 'blake3'  # rows pending since before 0006 were backfilled as 'sha256'
+        update_fields += ['file_hash', 'hash_algo']
+    try:
+        with transaction.atomic():
+            uploaded_file.save(update_fields=update_fields, defer_hash=True)
+    except IntegrityError:
+        # an identical file was hashed concurrently and won the unique constraint
+        uploaded_file.file_hash = None
+        _mark_duplicate(uploaded_file)
+        return False
+
+    return True
@@ -1,15 +1,34 @@
 import json
-
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from celery.app.task import Task
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
 from django.urls import reverse
 from freezegun import freeze_time
-from rest_framework import status
+from kombu.exceptions import OperationalError
+from rest_framework import serializers, status
 from rest_framework.test import APITestCase
 
 from authentication.models import CustomUser
-from chat.models import Conversation, Message, Role, Version
+from chat.models import Conversation, Message, Role, UploadedFile, Version
+from chat.serializers import VersionSerializer
+from chat.summary_service import ConversationSummaryService
+from chat.tasks import delete_conversations_in_batches, hash_and_dedupe_uploaded_file, requeue_pending_uploads
+
+# the project cache is Redis; tests run against an in-process cache instead
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
 
 
-class LoggedInConversationTests(APITestCase):
+@override_settings(CACHES=LOCMEM_CACHES)
+class ChatTestCase(APITestCase):
+    """Shared roles and user, an in-process cache, and Celery dispatch patched off the broker."""
+
     @classmethod
     def setUpTestData(cls):
         cls.user_role = Role.objects.create(name="user")
@@ -20,6 +39,17 @@ class LoggedInConversationTests(APITestCase):
         cls.mock_user.save()
 
     def setUp(self):
+        cache.clear()
+        # every delay()/apply_async() goes through Task.apply_async; tests that assert on a
+        # dispatch patch the specific task on top of this
+        apply_async_patcher = mock.patch.object(Task, "apply_async")
+        self.apply_async = apply_async_patcher.start()
+        self.addCleanup(apply_async_patcher.stop)
+
+
+class LoggedInConversationTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
         is_logged_in = self.client.login(email="mock@email.com", password="password")
         assert is_logged_in, "User login failed"
 
@@ -614,6 +644,57 @@ class LoggedInConversationTests(APITestCase):
         self.version.refresh_from_db()
         self.assertEqual(len(self.version.messages.all()), messages_count + 1)
 
+    def test_version_serializer_update_edits_existing_and_adds_new_messages(self):
+        data = {
+            "conversation_id": str(self.conversation.id),
+            "messages": [
+                {"id": str(self.messages[1].id), "content": "Edited answer", "role": "assistant"},
+                {"content": "Brand new question", "role": "user"},
+            ],
+        }
+        serializer = VersionSerializer(self.version, data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save(conversation=self.conversation)
+
+        self.messages[1].refresh_from_db()
+        self.assertEqual(self.messages[1].content, "Edited answer")
+        self.assertEqual(self.version.messages.count(), 5)
+        self.assertTrue(self.version.messages.filter(content="Brand new question", role=self.user_role).exists())
+
+    def test_version_serializer_update_unknown_message_id(self):
+        data = {
+            "conversation_id": str(self.conversation.id),
+            "messages": [{"id": self.nonexistent_uuid, "content": "Edited", "role": "user"}],
+        }
+        serializer = VersionSerializer(self.version, data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.assertRaises(serializers.ValidationError):
+            serializer.save(conversation=self.conversation)
+        self.assertEqual(self.version.messages.count(), 4)
+
+    def test_version_serializer_create_ignores_client_message_id(self):
+        data = {
+            "conversation_id": str(self.conversation.id),
+            "messages": [{"id": str(self.messages[0].id), "content": "Copied", "role": "user"}],
+        }
+        serializer = VersionSerializer(data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        version = serializer.save(conversation=self.conversation)
+
+        message = version.messages.get()
+        self.assertNotEqual(message.id, self.messages[0].id)
+        self.assertEqual(Message.objects.get(pk=self.messages[0].id).version, self.version)
+
+    def test_version_add_message_ignores_client_id(self):
+        url = reverse("version_add_message", kwargs={"pk": self.version.id})
+        response = self.client.post(
+            url,
+            data=json.dumps({**self.single_user_message, "id": self.nonexistent_uuid}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(response.data["message"]["id"], self.nonexistent_uuid)
+
     def test_version_add_message_no_content(self):
         messages_count = len(self.version.messages.all())
         url = reverse("version_add_message", kwargs={"pk": self.version.id})
@@ -649,3 +730,373 @@ class LoggedInConversationTests(APITestCase):
         )
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SummaryDispatchTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(title="Test title", user=self.mock_user)
+        self.version = Version.objects.create(conversation=self.conversation)
+        Conversation.objects.filter(pk=self.conversation.pk).update(is_summary_stale=False)
+
+    def add_messages(self, count):
+        for idx in range(count):
+            Message.objects.create(version=self.version, content=f"Message {idx}", role=self.user_role)
+
+    @mock.patch("chat.tasks.generate_conversation_summary_task.apply_async")
+    def test_summary_dispatched_once_after_commit(self, apply_async):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.add_messages(5)
+        apply_async.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+        apply_async.assert_called_once()
+
+    @mock.patch(
+        "chat.tasks.generate_conversation_summary_task.apply_async",
+        side_effect=OperationalError("Error 111 connecting to localhost:6379"),
+    )
+    def test_broker_outage_does_not_fail_message_write(self, apply_async):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_messages(3)
+
+        apply_async.assert_called()
+        self.assertEqual(Message.objects.filter(version=self.version).count(), 3)
+        self.conversation.refresh_from_db()
+        self.assertTrue(self.conversation.is_summary_stale)
+        self.assertIsNone(cache.get(f"sum_pending_{self.conversation.id}"))
+
+    def test_cache_outage_does_not_fail_message_write(self):
+        outage = ConnectionError("Error 111 connecting to localhost:6379")
+        broken_cache = mock.Mock(**{f"{method}.side_effect": outage for method in ("get", "add", "incr", "delete")})
+
+        with mock.patch("chat.summary_service.cache", broken_cache), mock.patch("chat.tasks.cache", broken_cache):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.add_messages(3)
+
+        self.apply_async.assert_not_called()
+        self.assertEqual(Message.objects.filter(version=self.version).count(), 3)
+        self.conversation.refresh_from_db()
+        self.assertTrue(self.conversation.is_summary_stale)
+
+
+@mock.patch(
+    "chat.summary_service.openai.ChatCompletion.create",
+    return_value={"choices": [{"message": {"content": "Summary"}}]},
+)
+class SummaryContextHashTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(title="Test title", user=self.mock_user)
+        self.version = Version.objects.create(conversation=self.conversation)
+        for idx in range(3):
+            self.add_message(f"Message {idx}")
+
+    def add_message(self, content):
+        Message.objects.create(version=self.version, content=content, role=self.user_role)
+
+    def test_unchanged_context_reuses_cached_summary(self, create):
+        self.assertTrue(ConversationSummaryService.update_conversation_summary(self.conversation))
+        create.assert_called_once()
+
+        self.assertEqual(ConversationSummaryService.generate_summary(self.conversation), "Summary")
+        create.assert_called_once()
+
+    def test_unchanged_context_falls_back_to_stored_summary(self, create):
+        ConversationSummaryService.update_conversation_summary(self.conversation)
+        cache.delete(f"conversation_summary_{self.conversation.id}")
+        self.conversation.refresh_from_db()
+
+        self.assertEqual(ConversationSummaryService.generate_summary(self.conversation), "Summary")
+        create.assert_called_once()
+
+    def test_changed_context_calls_openai(self, create):
+        ConversationSummaryService.update_conversation_summary(self.conversation)
+        self.add_message("Message 3")
+
+        ConversationSummaryService.generate_summary(self.conversation)
+        self.assertEqual(create.call_count, 2)
+        self.assertIn("Message 3", create.call_args.kwargs["messages"][1]["content"])
+
+    def test_mark_summary_stale_forces_regeneration(self, create):
+        ConversationSummaryService.update_conversation_summary(self.conversation)
+        ConversationSummaryService.mark_summary_stale(self.conversation)
+
+        ConversationSummaryService.generate_summary(self.conversation)
+        self.assertEqual(create.call_count, 2)
+
+
+class UploadedFileDedupeTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, content, **fields):
+        uploaded_file = UploadedFile(
+            user=self.mock_user,
+            file=SimpleUploadedFile("doc.pdf", content),
+            filename="doc.pdf",
+            file_size=len(content),
+            file_type="pdf",
+            **fields,
+        )
+        uploaded_file.save(defer_hash=True)
+        return uploaded_file
+
+    def test_unique_size_completes_without_hashing(self):
+        uploaded_file = self.upload(b"unique content")
+
+        with mock.patch.object(UploadedFile, "calculate_file_hash") as calculate_file_hash:
+            self.assertTrue(hash_and_dedupe_uploaded_file(uploaded_file.id))
+        calculate_file_hash.assert_not_called()
+
+        uploaded_file.refresh_from_db()
+        self.assertEqual(uploaded_file.status, "completed")
+        self.assertIsNone(uploaded_file.file_hash)
+        self.assertIsNotNone(uploaded_file.processed_at)
+
+    def test_same_size_different_content_completes(self):
+        original = self.upload(b"a" * 100)
+        hash_and_dedupe_uploaded_file(original.id)
+        other = self.upload(b"b" * 100)
+
+        self.assertTrue(hash_and_dedupe_uploaded_file(other.id))
+
+        other.refresh_from_db()
+        self.assertEqual(other.status, "completed")
+
+    def test_duplicate_is_failed_and_removed_from_storage(self):
+        original = self.upload(b"same content")
+        self.assertTrue(hash_and_dedupe_uploaded_file(original.id))
+        duplicate = self.upload(b"same content")
+        storage, duplicate_name = duplicate.file.storage, duplicate.file.name
+
+        self.assertFalse(hash_and_dedupe_uploaded_file(duplicate.id))
+
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.status, "failed")
+        self.assertEqual(duplicate.error_message, "duplicate")
+        self.assertFalse(storage.exists(duplicate_name))
+        self.assertFalse(duplicate.file)
+        self.assertEqual(UploadedFile.objects.filter(pk=duplicate.pk, file="").count(), 1)
+        # the earlier upload is hashed lazily, once something collides with it
+        original.refresh_from_db()
+        self.assertEqual(original.file_hash, UploadedFile.calculate_file_hash(original.file))
+        self.assertEqual(original.hash_algo, "blake3")
+        self.assertTrue(original.file.storage.exists(original.file.name))
+
+    def test_concurrent_duplicate_loses_unique_constraint(self):
+        uploaded_file = self.upload(b"same content")
+        content_hash = UploadedFile.calculate_file_hash(uploaded_file.file)
+        # an identical upload hashed by another worker after this one checked its candidates
+        self.upload(b"same content", file_hash=content_hash, status="completed")
+
+        def find_no_duplicate(uploaded, own_hashes):
+            own_hashes["blake3"] = content_hash
+            return None
+
+        with mock.patch("chat.tasks._find_duplicate", side_effect=find_no_duplicate):
+            self.assertFalse(hash_and_dedupe_uploaded_file(uploaded_file.id))
+
+        uploaded_file.refresh_from_db()
+        self.assertEqual(uploaded_file.status, "failed")
+        self.assertEqual(uploaded_file.error_message, "duplicate")
+        self.assertIsNone(uploaded_file.file_hash)
+
+    def test_duplicate_of_legacy_sha256_upload(self):
+        content = b"same content"
+        legacy = self.upload(content, status="completed", hash_algo="sha256")
+        UploadedFile.objects.filter(pk=legacy.pk).update(
+            file_hash=UploadedFile.calculate_file_hash(legacy.file, algo="sha256"), file_fingerprint=""
+        )
+        duplicate = self.upload(content)
+
+        self.assertFalse(hash_and_dedupe_uploaded_file(duplicate.id))
+
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.status, "failed")
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.hash_algo, "sha256")
+
+    def test_stored_hash_is_labelled_blake3(self):
+        # same size and sampled windows, different bytes in between: forces the full hash
+        content = bytearray(300 * 1024)
+        earlier = self.upload(bytes(content))
+        hash_and_dedupe_uploaded_file(earlier.id)
+        content[100 * 1024] = 1
+        # pending rows that existed before 0006 were backfilled as 'sha256'
+        uploaded_file = self.upload(bytes(content), hash_algo="sha256")
+
+        self.assertTrue(hash_and_dedupe_uploaded_file(uploaded_file.id))
+
+        uploaded_file.refresh_from_db()
+        self.assertEqual(uploaded_file.hash_algo, "blake3")
+        self.assertEqual(uploaded_file.file_hash, UploadedFile.calculate_file_hash(uploaded_file.file))
+
+    def test_files_equal(self):
+        self.assertTrue(UploadedFile.files_equal(SimpleUploadedFile("a", b"abc"), SimpleUploadedFile("b", b"abc")))
+        self.assertFalse(UploadedFile.files_equal(SimpleUploadedFile("a", b"abc"), SimpleUploadedFile("b", b"abd")))
+        self.assertFalse(UploadedFile.files_equal(SimpleUploadedFile("a", b"abc"), SimpleUploadedFile("b", b"ab")))
+
+    def test_processed_file_is_not_hashed_again(self):
+        uploaded_file = self.upload(b"content", status="completed")
+
+        with mock.patch.object(UploadedFile, "calculate_file_hash") as calculate_file_hash:
+            self.assertTrue(hash_and_dedupe_uploaded_file(uploaded_file.id))
+        calculate_file_hash.assert_not_called()
+
+    def test_missing_candidate_file_fails_upload(self):
+        original = self.upload(b"same content")
+        self.assertTrue(hash_and_dedupe_uploaded_file(original.id))
+        original.file.storage.delete(original.file.name)
+        uploaded_file = self.upload(b"same content")
+
+        self.assertFalse(hash_and_dedupe_uploaded_file(uploaded_file.id))
+
+        uploaded_file.refresh_from_db()
+        self.assertEqual(uploaded_file.status, "failed")
+        self.assertTrue(uploaded_file.error_message)
+        self.assertIsNotNone(uploaded_file.processed_at)
+
+    @mock.patch(
+        "chat.tasks.hash_and_dedupe_uploaded_file.delay",
+        side_effect=OperationalError("Error 111 connecting to localhost:6379"),
+    )
+    def test_broker_outage_leaves_upload_pending(self, delay):
+        self.client.login(email="mock@email.com", password="password")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("uploadedfile-list"),
+                {
+                    "file": SimpleUploadedFile("doc.pdf", b"content"),
+                    "filename": "doc.pdf",
+                    "file_size": 7,
+                    "file_type": "pdf",
+                },
+                format="multipart",
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        delay.assert_called_once_with(response.data["id"])
+        self.assertEqual(UploadedFile.objects.get(pk=response.data["id"]).status, "pending")
+
+    def test_requeue_pending_uploads(self):
+        with freeze_time("2024-01-01 12:00:00"):
+            stale = self.upload(b"stale")
+            self.upload(b"done", status="completed")
+        with freeze_time("2024-01-01 12:10:00"):
+            self.upload(b"fresh")
+
+        with freeze_time("2024-01-01 12:20:00"), mock.patch("chat.tasks.group") as group:
+            self.assertEqual(requeue_pending_uploads(), {"queued": 1})
+
+        signatures = list(group.call_args.args[0])
+        self.assertEqual([signature.args for signature in signatures], [(str(stale.id),)])
+        group.return_value.apply_async.assert_called_once()
+
+
+class MessageSaveTouchesConversationTests(ChatTestCase):
+    def test_saving_fetched_message_touches_conversation_in_one_update(self):
+        with freeze_time("2023-01-01 21:37:00"):
+            conversation = Conversation.objects.create(title="Test title", user=self.mock_user)
+            version = Version.objects.create(conversation=conversation)
+            message = Message.objects.create(version=version, content="Hi", role=self.user_role)
+
+        message = Message.objects.get(pk=message.pk)
+        message.content = "Hi again"
+        with freeze_time("2023-01-02 21:37:00"):
+            # UPDATE message + UPDATE conversation, without loading the version
+            with self.assertNumQueries(2):
+                message.save(update_fields=["content"])
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.modified_at.date().isoformat(), "2023-01-02")
+
+
+class RawDeleteConversationTests(ChatTestCase):
+    def make_branched_conversation(self, title):
+        conversation = Conversation.objects.create(title=title, user=self.mock_user)
+        version = Version.objects.create(conversation=conversation)
+        root_message = Message.objects.create(version=version, content="Question", role=self.user_role)
+        Message.objects.create(version=version, content="Answer", role=self.user_role)
+        branch = Version.objects.create(conversation=conversation, parent_version=version, root_message=root_message)
+        Message.objects.create(version=branch, content="Edited question", role=self.user_role)
+        conversation.active_version = branch
+        conversation.save()
+        uploaded_file = UploadedFile.objects.create(
+            user=self.mock_user,
+            conversation=conversation,
+            file=f"uploads/{title}.pdf",
+            filename=f"{title}.pdf",
+            file_size=1,
+            file_type="pdf",
+            file_hash=title,
+            file_fingerprint=title,
+        )
+        return conversation, uploaded_file
+
+    def test_raw_delete_in_batches(self):
+        old_conversations = [self.make_branched_conversation(title) for title in ("first", "second")]
+        kept_conversation, kept_file = self.make_branched_conversation("kept")
+        queryset = Conversation.objects.exclude(pk=kept_conversation.pk)
+
+        deleted_count = delete_conversations_in_batches(queryset, batch_size=1, raw=True)
+
+        self.assertEqual(deleted_count, 2)
+        self.assertEqual(list(Conversation.objects.all()), [kept_conversation])
+        self.assertFalse(Version.objects.exclude(conversation=kept_conversation).exists())
+        self.assertFalse(Message.objects.exclude(version__conversation=kept_conversation).exists())
+        self.assertEqual(Version.objects.count(), 2)
+        self.assertEqual(Message.objects.count(), 3)
+        for _, uploaded_file in old_conversations:
+            uploaded_file.refresh_from_db()
+            self.assertIsNone(uploaded_file.conversation_id)
+        kept_file.refresh_from_db()
+        self.assertEqual(kept_file.conversation_id, kept_conversation.id)
+
+
+class CleanupConversationsCommandTests(ChatTestCase):
+    def make_conversation(self, title, message_count):
+        conversation = Conversation.objects.create(title=title, user=self.mock_user)
+        version = Version.objects.create(conversation=conversation)
+        for idx in range(message_count):
+            Message.objects.create(version=version, content=f"Message {idx}", role=self.user_role)
+        return conversation
+
+    def dry_run(self):
+        out = StringIO()
+        call_command("cleanup_conversations", "--dry-run", stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_lists_message_counts(self):
+        with freeze_time("2024-01-01"):
+            self.make_conversation("Old with messages", 3)
+            self.make_conversation("Old single", 1)
+        self.make_conversation("Recent", 2)
+
+        # fewer rows than the preview size: the preview query doubles as the count
+        with self.assertNumQueries(1):
+            output = self.dry_run()
+
+        self.assertIn("Conversations to delete: 2", output)
+        self.assertIn("  - Old with messages (3 messages)", output)
+        self.assertIn("  - Old single (1 messages)", output)
+        self.assertNotIn("Recent", output)
+        self.assertEqual(Conversation.objects.count(), 3)
+
+    def test_dry_run_counts_beyond_preview(self):
+        with freeze_time("2024-01-01"):
+            for idx in range(6):
+                self.make_conversation(f"Old {idx}", 1)
+
+        with self.assertNumQueries(2):
+            output = self.dry_run()
+
+        self.assertIn("Conversations to delete: 6", output)
+        self.assertEqual(output.count("(1 messages)"), 5)
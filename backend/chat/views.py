@@ -6,10 +6,11 @@ from rest_framework.response import Response
 
 from chat.models import Conversation, Message, Version, UploadedFile
 from chat.serializers import ConversationSerializer, MessageSerializer, TitleSerializer, VersionSerializer
+from chat.summary_service import ConversationSummaryService
 from chat.utils.branching import make_branched_conversation
 from rest_framework.pagination import PageNumberPagination
 from rest_framework import viewsets, permissions
-from django.db.models import Q
+from django.db.models import Count, Q
 from .models import Conversation
 from .serializers import ConversationSummarySerializer, UploadedFileSerializer
 
@@ -26,7 +27,11 @@ def chat_root_view(request):
 @login_required
 @api_view(["GET"])
 def get_conversations(request):
-    conversations = Conversation.objects.filter(user=request.user, deleted_at__isnull=True).order_by("-modified_at")
+    conversations = (
+        Conversation.objects.filter(user=request.user, deleted_at__isnull=True)
+        .prefetch_related("versions__root_message", "versions__messages__role")
+        .order_by("-modified_at")
+    )
     serializer = ConversationSerializer(conversations, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -34,7 +39,11 @@ def get_conversations(request):
 @login_required
 @api_view(["GET"])
 def get_conversations_branched(request):
-    conversations = Conversation.objects.filter(user=request.user, deleted_at__isnull=True).order_by("-modified_at")
+    conversations = (
+        Conversation.objects.filter(user=request.user, deleted_at__isnull=True)
+        .prefetch_related("versions__root_message", "versions__messages__role")
+        .order_by("-modified_at")
+    )
     conversations_serializer = ConversationSerializer(conversations, many=True)
     conversations_data = conversations_serializer.data
 
@@ -194,6 +203,7 @@ def conversation_add_version(request, pk):
         Message(content=message.content, role=message.role, version=new_version) for message in messages_before_root
     ]
     Message.objects.bulk_create(new_messages)
+    ConversationSummaryService.increment_message_count(conversation.id, len(new_messages))
 
     # Set the new version as the current version
     conversation.active_version = new_version
@@ -250,7 +260,7 @@ class ConversationSummaryViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         queryset = Conversation.objects.filter(
             user=self.request.user
-        )
+        ).annotate(message_count=Count("versions__messages"))
 
         has_summary = self.request.query_params.get("has_summary")
         if has_summary == "true":
@@ -277,7 +287,8 @@ class ConversationSummaryViewSet(viewsets.ReadOnlyModelViewSet):
 class UploadedFileViewSet(viewsets.ModelViewSet):
     """CRUD operations for user-uploaded files.
 
-    * POST /files/          -> upload new file with duplicate prevention
+    * POST /files/          -> upload new file; duplicate detection runs in the background and
+                               marks duplicates status='failed' (their bytes are removed)
     * GET  /files/          -> list user's files (pagination supported)
     * GET  /files/{pk}/     -> retrieve metadata for a single file
     * DELETE /files/{pk}/   -> delete file record and remove file from storage